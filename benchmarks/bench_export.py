@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+列式导出性能测试
+生成合成的 LLM 代理日志，对比不同进程数下的导出速度 (rows/sec)
+"""
+import sys
+import os
+import json
+import time
+import uuid
+import argparse
+import tempfile
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.export.columnar import export_logs
+
+
+def generate_logs(log_dir: Path, count: int):
+    """生成流式响应的合成日志"""
+    for i in range(count):
+        log_id = str(uuid.uuid4())
+        chunks = [
+            f'data: {{"choices":[{{"delta":{{"content":"token {j} "}}}}]}}\n\n'
+            for j in range(50)
+        ]
+        chunks.append(
+            'data: {"choices":[],"usage":{"prompt_tokens":120,"completion_tokens":50,"total_tokens":170}}\n\n'
+            'data: [DONE]\n\n'
+        )
+        data = {
+            "id": log_id,
+            "timestamp": str(datetime.now()),
+            "method": "POST",
+            "path": "/v1/chat/completions",
+            "headers": {"content-type": "application/json"},
+            "body": {
+                "model": "gpt-4o-mini",
+                "stream": True,
+                "messages": [
+                    {"role": "system", "content": "You are a helpful assistant."},
+                    {"role": "user", "content": f"Question number {i}: " + "lorem ipsum " * 40}
+                ]
+            },
+            "response_status": 200,
+            "response_headers": {"content-type": "text/event-stream"},
+            "response_body": None,
+            "response_chunks": chunks,
+            "duration_ms": 1234.5
+        }
+        with open(log_dir / f"{log_id}.json", 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="列式导出性能测试")
+    parser.add_argument("--count", type=int, default=20000, help="合成日志数量 (默认: 20000)")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, os.cpu_count() or 1],
+        help="测试的进程数列表 (默认: 1 和 CPU 核数)"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        log_dir = Path(tmp) / "llm_proxy"
+        log_dir.mkdir()
+        print(f"生成 {args.count} 条合成日志...", flush=True)
+        generate_logs(log_dir, args.count)
+
+        for include_text in (False, True):
+            for fmt in ("parquet", "arrow"):
+                for workers in args.workers:
+                    output = Path(tmp) / f"out.{fmt}"
+                    start_time = time.perf_counter()
+                    rows = export_logs(log_dir, output, fmt=fmt, include_text=include_text, workers=workers)
+                    elapsed = time.perf_counter() - start_time
+                    print(
+                        f"format={fmt:<8} include_text={str(include_text):<5} workers={workers:<3} "
+                        f"rows={rows} time={elapsed:.2f}s rows/sec={rows / elapsed:,.0f}",
+                        flush=True
+                    )
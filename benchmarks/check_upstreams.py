@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+"""
+多上游路由检查
+用 httpx.MockTransport 模拟上游，验证故障转移、并发上限以及流结束或客户端断开后名额的释放
+"""
+import sys
+import os
+import json
+import asyncio
+import tempfile
+from pathlib import Path
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.proxy.llm_proxy as llm_proxy_module
+from src.proxy.llm_proxy import LLMProxy, ProxyConfig
+
+
+class StubUpstreams:
+    """按主机名模拟不同行为的上游"""
+
+    def __init__(self):
+        self.gate = asyncio.Event()  # slow 上游在放行前不结束响应
+        self.active = 0
+        self.max_active = 0
+        self.calls = {}
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.calls[host] = self.calls.get(host, 0) + 1
+        if host == "down":
+            raise httpx.ConnectError("connection refused", request=request)
+        if host == "hung":
+            raise httpx.ReadTimeout("read timed out", request=request)
+        if host == "busy":
+            return httpx.Response(503, json={"error": "overloaded"})
+        if host == "slow":
+            return httpx.Response(
+                200, headers={"content-type": "text/event-stream"}, content=self.slow_stream()
+            )
+        if request.url.path.endswith("/stream"):
+            return httpx.Response(
+                200, headers={"content-type": "text/event-stream"}, content=self.sse_chunks()
+            )
+        return httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+
+    async def sse_chunks(self):
+        for i in range(3):
+            yield f'data: {{"choices":[{{"delta":{{"content":"{i}"}}}}]}}\n\n'.encode()
+        yield b"data: [DONE]\n\n"
+
+    async def slow_stream(self):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            yield b'data: {"choices":[{"delta":{"content":"a"}}]}\n\n'
+            await self.gate.wait()
+            yield b"data: [DONE]\n\n"
+        finally:
+            self.active -= 1
+
+
+def build_proxy(tmp_dir: Path, upstreams: list, stubs: StubUpstreams) -> LLMProxy:
+    """创建使用模拟上游的代理"""
+    pool_file = tmp_dir / "upstreams.json"
+    pool_file.write_text(json.dumps({"upstreams": upstreams, "failure_cooldown": 0}))
+    proxy = LLMProxy(ProxyConfig(log_dir=tmp_dir / "logs", upstreams_file=pool_file))
+    proxy.client = httpx.AsyncClient(transport=httpx.MockTransport(stubs.handler))
+    llm_proxy_module.llm_proxy = proxy
+    return proxy
+
+
+async def call(path: str, spec_version: str = "2.4", fail_on=None, disconnect: bool = False):
+    """直接以 ASGI 方式调用代理，可模拟发送失败或客户端断开，返回 (状态码, 响应体)"""
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": spec_version},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json")],
+        "client": ("127.0.0.1", 50000),
+        "server": ("testserver", 80),
+    }
+    body_sent = False
+    messages = []
+
+    async def receive():
+        nonlocal body_sent
+        if not body_sent:
+            body_sent = True
+            return {"type": "http.request", "body": b'{"model": "stub"}', "more_body": False}
+        if disconnect:
+            return {"type": "http.disconnect"}
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == fail_on:
+            raise OSError("client went away")
+        messages.append(message)
+
+    try:
+        await llm_proxy_module.app(scope, receive, send)
+    except Exception:
+        pass
+    status = next((m["status"] for m in messages if m["type"] == "http.response.start"), None)
+    body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.response.body")
+    return status, body
+
+
+def outstanding(proxy: LLMProxy) -> int:
+    return sum(u.outstanding for u in proxy.upstream_pool.upstreams)
+
+
+async def check_failover_on_503(tmp_dir: Path):
+    stubs = StubUpstreams()
+    proxy = build_proxy(tmp_dir, [{"url": "http://busy"}, {"url": "http://ok"}], stubs)
+    status, _ = await call("/v1/chat/completions")
+    assert status == 200, status
+    assert stubs.calls == {"busy": 1, "ok": 1}, stubs.calls
+    assert outstanding(proxy) == 0
+
+
+async def check_failover_on_connect_error(tmp_dir: Path):
+    stubs = StubUpstreams()
+    proxy = build_proxy(tmp_dir, [{"url": "http://down"}, {"url": "http://ok"}], stubs)
+    status, body = await call("/v1/chat/stream")
+    assert status == 200, status
+    assert b"[DONE]" in body
+    assert proxy.upstream_pool.upstreams[0].failures == 1
+    assert outstanding(proxy) == 0
+
+
+async def check_no_retry_after_request_sent(tmp_dir: Path):
+    stubs = StubUpstreams()
+    proxy = build_proxy(tmp_dir, [{"url": "http://hung"}, {"url": "http://ok"}], stubs)
+    # 读超时时上游可能已经收到请求，不能再发给另一个上游
+    status, _ = await call("/v1/chat/completions")
+    assert status == 500, status
+    assert stubs.calls == {"hung": 1}, stubs.calls
+    assert outstanding(proxy) == 0
+
+
+async def check_all_upstreams_failing(tmp_dir: Path):
+    stubs = StubUpstreams()
+    proxy = build_proxy(tmp_dir, [{"url": "http://down"}, {"url": "http://busy"}], stubs)
+    status, _ = await call("/v1/chat/completions")
+    assert status == 503, status
+    assert outstanding(proxy) == 0
+
+
+async def check_concurrency_limit(tmp_dir: Path):
+    stubs = StubUpstreams()
+    proxy = build_proxy(tmp_dir, [{"url": "http://slow", "max_concurrency": 1}], stubs)
+    tasks = [asyncio.create_task(call("/v1/chat/stream")) for _ in range(2)]
+    await asyncio.sleep(0.2)
+    assert stubs.calls == {"slow": 1}, stubs.calls
+    assert outstanding(proxy) == 1
+    stubs.gate.set()
+    results = await asyncio.wait_for(asyncio.gather(*tasks), timeout=5)
+    assert [status for status, _ in results] == [200, 200]
+    assert stubs.max_active == 1
+    assert outstanding(proxy) == 0
+
+
+async def check_release_on_disconnect(tmp_dir: Path):
+    stubs = StubUpstreams()
+    proxy = build_proxy(tmp_dir, [{"url": "http://slow", "max_concurrency": 1}], stubs)
+    # 发送响应头失败，生成器从未被迭代
+    await call("/v1/chat/stream", fail_on="http.response.start")
+    assert outstanding(proxy) == 0
+    # 发送第一个数据块时失败
+    await call("/v1/chat/stream", fail_on="http.response.body")
+    assert outstanding(proxy) == 0
+    # 旧版 ASGI 服务器通过 http.disconnect 通知断开
+    await asyncio.wait_for(call("/v1/chat/stream", spec_version="2.0", disconnect=True), timeout=5)
+    assert outstanding(proxy) == 0
+    # 名额已释放，新的请求不会一直等待
+    stubs.gate.set()
+    status, _ = await asyncio.wait_for(call("/v1/chat/stream"), timeout=5)
+    assert status == 200, status
+
+
+async def main():
+    checks = [
+        check_failover_on_503,
+        check_failover_on_connect_error,
+        check_no_retry_after_request_sent,
+        check_all_upstreams_failing,
+        check_concurrency_limit,
+        check_release_on_disconnect,
+    ]
+    failed = 0
+    with tempfile.TemporaryDirectory() as tmp:
+        for check in checks:
+            tmp_dir = Path(tmp) / check.__name__
+            tmp_dir.mkdir()
+            try:
+                await check(tmp_dir)
+                print(f"✅ {check.__name__}")
+            except Exception as e:
+                failed += 1
+                print(f"❌ {check.__name__}: {e!r}")
+    return failed
+
+
+if __name__ == "__main__":
+    sys.exit(1 if asyncio.run(main()) else 0)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+"""
+导出 LLM 代理日志为 Parquet / Arrow IPC
+"""
+import sys
+import os
+import time
+import argparse
+from pathlib import Path
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from src.export.columnar import export_logs
+
+if __name__ == "__main__":
+    # 解析命令行参数
+    parser = argparse.ArgumentParser(description="LLM 代理日志列式导出")
+    parser.add_argument(
+        "--log-dir",
+        default="logs/llm_proxy",
+        help="LLM 代理日志目录 (默认: logs/llm_proxy)"
+    )
+    parser.add_argument(
+        "--output",
+        required=True,
+        help="输出文件路径"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["parquet", "arrow"],
+        default="parquet",
+        help="导出格式 (默认: parquet)"
+    )
+    parser.add_argument(
+        "--include-text",
+        action="store_true",
+        help="导出 prompt / completion 文本列"
+    )
+    parser.add_argument(
+        "--cursor-file",
+        help="增量导出游标文件，只导出上次导出之后的新记录"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="解析进程数 (默认: CPU 核数)"
+    )
+    args = parser.parse_args()
+    
+    print(f"📦 导出日志: {args.log_dir} → {args.output} ({args.format})", flush=True)
+    start_time = time.time()
+    rows = export_logs(
+        log_dir=Path(args.log_dir),
+        output=Path(args.output),
+        fmt=args.format,
+        include_text=args.include_text,
+        cursor_file=Path(args.cursor_file) if args.cursor_file else None,
+        workers=args.workers
+    )
+    elapsed = time.time() - start_time
+    
+    if rows == 0:
+        print("没有需要导出的新记录", flush=True)
+    else:
+        print(f"✅ 导出 {rows} 条记录，耗时 {elapsed:.2f}s ({rows / elapsed:.0f} rows/s)", flush=True)
@@ -25,14 +25,31 @@ if __name__ == "__main__":
         default=8000,
         help="代理服务端口 (默认: 8000)"
     )
+    parser.add_argument(
+        "--capture-policy",
+        default=os.getenv("CAPTURE_POLICY_FILE"),
+        help="日志采集策略 JSON 文件，修改后自动生效 (默认: 完整记录所有请求)"
+    )
+    parser.add_argument(
+        "--upstreams",
+        default=os.getenv("UPSTREAMS_FILE"),
+        help="多上游配置 JSON 文件，设置后忽略 --target-url"
+    )
     args = parser.parse_args()
     
     # 设置环境变量
     os.environ["TARGET_BASE_URL"] = args.target_url
+    if args.capture_policy:
+        os.environ["CAPTURE_POLICY_FILE"] = args.capture_policy
+    if args.upstreams:
+        os.environ["UPSTREAMS_FILE"] = args.upstreams
     
     print("🚀 启动 LLM 代理服务...", flush=True)
     print(f"📡 代理地址: http://localhost:{args.port}", flush=True)
-    print(f"🎯 目标 API: {args.target_url}", flush=True)
+    if args.upstreams:
+        print(f"🎯 上游池配置: {args.upstreams}", flush=True)
+    else:
+        print(f"🎯 目标 API: {args.target_url}", flush=True)
     print("\n💡 使用方法:", flush=True)
     print(f"   在客户端设置 API Base URL 为: http://localhost:{args.port}/v1", flush=True)
     print("   保持 API Key 不变\n", flush=True)
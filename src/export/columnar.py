@@ -0,0 +1,319 @@
+"""
+日志列式导出
+将 logs/llm_proxy/*.json 并行解析为扁平记录，导出为 Parquet / Arrow IPC
+"""
+import asyncio
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Tuple
+
+# 导出游标：最后导出文件的 (mtime, 文件名)，日志文件写入后不再修改
+Cursor = Tuple[float, str]
+
+BATCH_SIZE = 1000
+
+
+def require_pyarrow():
+    """按需导入 pyarrow（可选依赖）"""
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise RuntimeError("列式导出需要 pyarrow，请运行: uv sync --extra export") from e
+    return pyarrow
+
+
+def build_schema(include_text: bool = False):
+    """导出数据的扁平 schema，prompt / completion 文本为可选列"""
+    pa = require_pyarrow()
+    fields = [
+        pa.field("id", pa.string()),
+        pa.field("timestamp", pa.timestamp("us")),
+        pa.field("method", pa.string()),
+        pa.field("path", pa.string()),
+        pa.field("model", pa.string()),
+        pa.field("status", pa.int32()),
+        pa.field("duration_ms", pa.float64()),
+        pa.field("stream", pa.bool_()),
+        pa.field("capture_level", pa.string()),
+        pa.field("prompt_tokens", pa.int64()),
+        pa.field("completion_tokens", pa.int64()),
+        pa.field("total_tokens", pa.int64()),
+    ]
+    if include_text:
+        fields += [
+            pa.field("prompt_text", pa.string()),
+            pa.field("completion_text", pa.string()),
+        ]
+    return pa.schema(fields)
+
+
+def list_log_files(log_dir: Path, cursor: Optional[Cursor] = None) -> List[Tuple[Cursor, Path]]:
+    """按 (mtime, 文件名) 排序列出游标之后的日志文件"""
+    files = []
+    if not log_dir.exists():
+        return files
+    for entry in os.scandir(log_dir):
+        if not entry.name.endswith(".json"):
+            continue
+        key = (entry.stat().st_mtime, entry.name)
+        if cursor is None or key > cursor:
+            files.append((key, Path(entry.path)))
+    files.sort(key=lambda item: item[0])
+    return files
+
+
+def load_cursor(cursor_file: Path) -> Optional[Cursor]:
+    """读取上次导出的游标"""
+    if not cursor_file.exists():
+        return None
+    with open(cursor_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return (data["mtime"], data["name"])
+
+
+def save_cursor(cursor_file: Path, cursor: Cursor):
+    """保存导出游标"""
+    with open(cursor_file, 'w', encoding='utf-8') as f:
+        json.dump({"mtime": cursor[0], "name": cursor[1]}, f)
+
+
+def _message_text(content: Any) -> str:
+    """提取消息文本，兼容多段内容格式"""
+    if isinstance(content, list):
+        return "\n".join(
+            part.get("text", "") for part in content
+            if isinstance(part, dict) and part.get("type") == "text"
+        )
+    return content if isinstance(content, str) else ""
+
+
+def extract_row(data: Dict[str, Any], include_text: bool = False) -> Dict[str, Any]:
+    """将单条 LLM 日志转换为扁平记录"""
+    body = data.get("body") if isinstance(data.get("body"), dict) else {}
+    response_body = data.get("response_body")
+    # 顶层 usage / stream 在 metadata 级别和截断时同样保留，旧日志回退到请求体和响应体
+    usage = data.get("usage")
+    if usage is None and isinstance(response_body, dict):
+        usage = response_body.get("usage")
+    completion_parts = []
+
+    chunks = data.get("response_chunks") or []
+    # 已有顶层 usage 且不导出文本时无需解析数据块
+    if chunks and (include_text or usage is None):
+        chunks_text = "\n".join(chunks) if isinstance(chunks, list) else chunks
+        for line in chunks_text.split("\n"):
+            if not line.startswith("data: ") or line.startswith("data: [DONE]"):
+                continue
+            # 不导出文本时只需解析包含 usage 的数据块
+            if not include_text and '"usage"' not in line:
+                continue
+            try:
+                chunk_data = json.loads(line[6:])
+            except json.JSONDecodeError:
+                continue
+            if chunk_data.get("usage") and data.get("usage") is None:
+                usage = chunk_data["usage"]
+            if include_text and chunk_data.get("choices"):
+                delta = chunk_data["choices"][0].get("delta") or {}
+                if delta.get("content"):
+                    completion_parts.append(delta["content"])
+
+    usage = usage if isinstance(usage, dict) else {}
+    timestamp = data.get("timestamp")
+    model = data.get("model") or body.get("model")
+    stream = data.get("stream")
+    if stream is None:
+        content_type = (data.get("response_headers") or {}).get("content-type", "")
+        stream = "text/event-stream" in content_type or bool(body.get("stream", False))
+
+    row = {
+        "id": data.get("id"),
+        "timestamp": datetime.fromisoformat(timestamp) if timestamp else None,
+        "method": data.get("method"),
+        "path": data.get("path"),
+        "model": model if isinstance(model, str) else None,
+        "status": data.get("response_status"),
+        "duration_ms": data.get("duration_ms"),
+        "stream": bool(stream),
+        "capture_level": data.get("capture_level", "full"),
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "total_tokens": usage.get("total_tokens"),
+    }
+
+    if include_text:
+        row["prompt_text"] = "\n".join(
+            f"{msg.get('role', 'unknown')}: {_message_text(msg.get('content'))}"
+            for msg in body.get("messages", []) if isinstance(msg, dict)
+        ) or None
+        if not completion_parts and isinstance(response_body, dict):
+            for choice in response_body.get("choices", []) or []:
+                completion_parts.append(_message_text((choice.get("message") or {}).get("content")))
+        row["completion_text"] = "".join(completion_parts) or None
+
+    return row
+
+
+def extract_batch(paths: List[str], include_text: bool = False) -> List[Dict[str, Any]]:
+    """解析一批日志文件（在进程池中运行）"""
+    rows = []
+    for path in paths:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                rows.append(extract_row(json.load(f), include_text))
+        except Exception as e:
+            print(f"Error exporting log file {path}: {e}")
+    return rows
+
+
+def split_batches(files: List[Path], workers: int, batch_size: int = BATCH_SIZE) -> List[List[str]]:
+    """切分文件批次，文件较少时缩小批次让每个进程都能分到任务"""
+    size = max(1, min(batch_size, -(-len(files) // (workers * 4))))
+    return [[str(p) for p in files[i:i + size]] for i in range(0, len(files), size)]
+
+
+def iter_row_batches(
+    files: List[Path],
+    include_text: bool = False,
+    workers: Optional[int] = None,
+    batch_size: int = BATCH_SIZE
+) -> Iterator[List[Dict[str, Any]]]:
+    """按批并行解析日志文件，保持文件顺序产出记录"""
+    workers = workers or os.cpu_count() or 1
+    batches = split_batches(files, workers, batch_size)
+    if workers == 1 or len(batches) <= 1:
+        for batch in batches:
+            yield extract_batch(batch, include_text)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(extract_batch, batches, [include_text] * len(batches))
+
+
+def open_writer(sink, schema, fmt: str):
+    """创建 Parquet 或 Arrow IPC（stream 格式）写入器"""
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(sink, schema, compression="zstd")
+    if fmt == "arrow":
+        import pyarrow.ipc as ipc
+        return ipc.new_stream(sink, schema)
+    raise ValueError(f"Unsupported export format: {fmt}")
+
+
+def export_logs(
+    log_dir: Path,
+    output: Path,
+    fmt: str = "parquet",
+    include_text: bool = False,
+    cursor_file: Optional[Path] = None,
+    workers: Optional[int] = None
+) -> int:
+    """导出日志到文件，指定游标文件时只导出上次之后的新记录，返回导出行数"""
+    pa = require_pyarrow()
+    cursor = load_cursor(cursor_file) if cursor_file else None
+    files = list_log_files(log_dir, cursor)
+    if not files:
+        return 0
+
+    schema = build_schema(include_text)
+    rows = 0
+    writer = open_writer(str(output), schema, fmt)
+    try:
+        for batch in iter_row_batches([p for _, p in files], include_text, workers):
+            if batch:
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+                rows += len(batch)
+    finally:
+        writer.close()
+
+    if cursor_file:
+        save_cursor(cursor_file, files[-1][0])
+    return rows
+
+
+class ChunkSink:
+    """收集写入器输出的字节，供流式响应按批取出"""
+
+    def __init__(self):
+        self.chunks: List[bytes] = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def create_export_executor(workers: Optional[int] = None) -> ProcessPoolExecutor:
+    """创建供流式导出共享的进程池
+
+    子进程由 forkserver（不支持时为 spawn）启动，不继承 Web 服务的线程和 SQLite 连接；
+    子进程在提交任务时按需创建，没有导出请求时不会启动
+    """
+    methods = multiprocessing.get_all_start_methods()
+    mp_context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    return ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1, mp_context=mp_context)
+
+
+async def stream_export(
+    files: List[Path],
+    executor: ProcessPoolExecutor,
+    workers: int,
+    fmt: str = "arrow",
+    include_text: bool = False,
+    batch_size: int = BATCH_SIZE
+) -> AsyncIterator[bytes]:
+    """流式导出：在共享进程池中解析日志，每完成一批即输出编码后的字节
+
+    客户端断开时生成器被关闭，尚未开始的批次会被取消，不会阻塞事件循环等待进程池
+    """
+    pa = require_pyarrow()
+    schema = build_schema(include_text)
+    sink = ChunkSink()
+    writer = open_writer(sink, schema, fmt)
+    loop = asyncio.get_running_loop()
+    batches = split_batches(files, workers, batch_size)
+
+    # 最多同时提交 2 倍进程数的批次，按顺序输出以限制内存占用
+    pending = deque()
+    batch_iter = iter(batches)
+    try:
+        for batch in islice(batch_iter, workers * 2):
+            pending.append(loop.run_in_executor(executor, extract_batch, batch, include_text))
+        while pending:
+            rows = await pending.popleft()
+            next_batch = next(batch_iter, None)
+            if next_batch is not None:
+                pending.append(loop.run_in_executor(executor, extract_batch, next_batch, include_text))
+            if rows:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                yield sink.drain()
+    finally:
+        for future in pending:
+            future.cancel()
+        writer.close()
+
+    yield sink.drain()
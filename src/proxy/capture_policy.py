@@ -0,0 +1,124 @@
+"""
+日志采集策略
+按路径 / 模型 / 状态码规则决定每个请求的记录级别，支持采样和热加载
+"""
+import json
+import random
+import time
+from fnmatch import fnmatchcase
+from pathlib import Path
+from typing import Dict, List, Literal, Optional
+from pydantic import BaseModel, Field
+
+# full: 完整记录请求体和响应体；metadata: 仅记录元数据；none: 不记录
+CaptureLevel = Literal["full", "metadata", "none"]
+
+
+class CaptureRule(BaseModel):
+    """采集规则，未设置的匹配条件视为匹配任意值"""
+    path: Optional[str] = None  # 路径通配符，如 "/v1/chat/*"
+    model: Optional[str] = None  # 模型通配符，如 "gpt-4*"
+    status: Optional[str] = None  # 状态码通配符，如 "5??"
+    level: CaptureLevel = "full"
+    sample_rate: float = Field(1.0, ge=0.0, le=1.0)  # 命中采样时使用 level
+    unsampled_level: CaptureLevel = "metadata"  # 未命中采样时使用的级别
+    max_body_bytes: Optional[int] = Field(None, ge=0)  # 请求体 / 响应体大小上限
+    header_allowlist: Optional[List[str]] = None  # 仅记录这些请求头 / 响应头
+
+    def matches(self, path: str, model: Optional[str], status: Optional[int]) -> bool:
+        """判断规则是否匹配当前请求"""
+        if self.path is not None and not fnmatchcase(path, self.path):
+            return False
+        if self.model is not None and not fnmatchcase(model or "", self.model):
+            return False
+        if self.status is not None and not fnmatchcase(str(status or ""), self.status):
+            return False
+        return True
+
+
+class CaptureDecision(BaseModel):
+    """单个请求的采集决策"""
+    level: CaptureLevel
+    max_body_bytes: Optional[int] = None
+    header_allowlist: Optional[List[str]] = None
+
+    def filter_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
+        """按白名单过滤请求头 / 响应头"""
+        if self.header_allowlist is None:
+            return headers
+        allowed = {name.lower() for name in self.header_allowlist}
+        return {k: v for k, v in headers.items() if k.lower() in allowed}
+
+
+class CapturePolicy(BaseModel):
+    """采集策略：按顺序匹配规则，首个命中的规则生效"""
+    rules: List[CaptureRule] = []
+    default: CaptureRule = CaptureRule()
+    always_capture_errors: bool = True  # 4xx/5xx 响应跳过采样完整记录（level 为 none 的规则除外）
+
+    def evaluate(self, path: str, model: Optional[str], status: Optional[int]) -> CaptureDecision:
+        """计算请求的采集决策"""
+        rule = next(
+            (r for r in self.rules if r.matches(path, model, status)),
+            self.default
+        )
+
+        max_body_bytes = rule.max_body_bytes
+        if rule.level == "none":
+            # 明确不记录的规则（如健康检查）对错误响应同样生效
+            level = "none"
+        elif self.always_capture_errors and status is not None and status >= 400:
+            # 错误响应跳过采样且不截断，请求头 / 响应头仍按白名单过滤
+            level = "full"
+            max_body_bytes = None
+        elif rule.sample_rate >= 1.0 or random.random() < rule.sample_rate:
+            level = rule.level
+        else:
+            level = rule.unsampled_level
+
+        return CaptureDecision(
+            level=level,
+            max_body_bytes=max_body_bytes,
+            header_allowlist=rule.header_allowlist
+        )
+
+
+class CapturePolicyLoader:
+    """从 JSON 文件加载采集策略，文件修改后自动重新加载"""
+
+    def __init__(self, policy_file: Optional[Path], check_interval: float = 1.0):
+        self.policy_file = policy_file
+        self.check_interval = check_interval
+        self.policy = CapturePolicy()
+        self._mtime: Optional[float] = None
+        self._last_check = 0.0
+        self.reload()
+
+    def reload(self):
+        """重新读取策略文件，解析失败时保留旧策略"""
+        if self.policy_file is None:
+            return
+        try:
+            # 先记录 mtime，避免错误的策略文件被反复加载
+            self._mtime = self.policy_file.stat().st_mtime
+            with open(self.policy_file, 'r', encoding='utf-8') as f:
+                self.policy = CapturePolicy.model_validate(json.load(f))
+            print(f"📋 已加载采集策略: {self.policy_file} ({len(self.policy.rules)} 条规则)")
+        except Exception as e:
+            print(f"⚠️ 加载采集策略失败，继续使用当前策略: {e}")
+
+    def current(self) -> CapturePolicy:
+        """返回当前策略，按间隔检查文件是否被修改"""
+        if self.policy_file is None:
+            return self.policy
+
+        now = time.monotonic()
+        if now - self._last_check >= self.check_interval:
+            self._last_check = now
+            try:
+                mtime = self.policy_file.stat().st_mtime
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != self._mtime:
+                self.reload()
+        return self.policy
@@ -8,18 +8,28 @@ import uuid
 import os
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Tuple
 import httpx
 from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.types import Receive, Scope, Send
 import asyncio
 from pydantic import BaseModel
 
+from src.proxy.capture_policy import CaptureDecision, CapturePolicyLoader
+from src.proxy.log_journal import append_journal
+from src.proxy.upstream_pool import (
+    RETRYABLE_STATUS_CODES, RETRYABLE_TRANSPORT_ERRORS, Upstream, UpstreamPool
+)
+
 class ProxyConfig(BaseModel):
     """代理配置"""
     target_base_url: str = os.getenv("TARGET_BASE_URL", "https://api.openai.com")
     log_dir: Path = Path("logs/llm_proxy")
     enable_logging: bool = True
+    capture_policy_file: Optional[Path] = None
+    upstreams_file: Optional[Path] = None  # 多上游配置，设置后忽略 target_base_url
 
 class RequestLog(BaseModel):
     """请求日志模型"""
@@ -28,28 +38,173 @@ class RequestLog(BaseModel):
     method: str
     path: str
     headers: Dict[str, str]
-    body: Optional[Dict[str, Any]]
+    body: Optional[Any]
+    model: Optional[str] = None
     response_status: Optional[int] = None
     response_headers: Optional[Dict[str, str]] = None
     response_body: Optional[Any] = None
     response_chunks: list = []
     duration_ms: Optional[float] = None
+    capture_level: str = "full"
+    truncated: bool = False
+    stream: bool = False  # 上游是否返回了流式响应
+    usage: Optional[Dict[str, Any]] = None  # token 用量，metadata 级别和截断时同样保留
+    upstream: Optional[str] = None
+    upstream_attempts: list = []
+
+class SSEUsageParser:
+    """从流式响应的数据块中提取 token 用量，数据块可能在任意位置切分"""
+    
+    def __init__(self):
+        self.usage: Optional[Dict[str, Any]] = None
+        self._partial = b""
+    
+    def feed(self, chunk: bytes):
+        lines = (self._partial + chunk).split(b"\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+    
+    def close(self):
+        if self._partial:
+            self._parse_line(self._partial)
+            self._partial = b""
+    
+    def _parse_line(self, line: bytes):
+        # 只有包含 usage 的数据块需要解析，通常是最后一个
+        if not line.startswith(b"data: ") or b'"usage"' not in line:
+            return
+        try:
+            data = json.loads(line[6:])
+        except ValueError:
+            return
+        if isinstance(data, dict) and isinstance(data.get("usage"), dict):
+            self.usage = data["usage"]
+
+class UpstreamStreamingResponse(StreamingResponse):
+    """无论正常结束、客户端断开还是发送响应头失败都会执行 background 的流式响应
+
+    Starlette 在客户端断开或发送失败时会跳过 background，且可能从未迭代生成器，
+    上游连接和并发名额需要在这里兜底释放
+    """
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        background, self.background = self.background, None
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            if background is not None:
+                await background()
 
 class LLMProxy:
     def __init__(self, config: ProxyConfig):
         self.config = config
         self.config.log_dir.mkdir(parents=True, exist_ok=True)
         self.client = httpx.AsyncClient(timeout=60.0)
-        print(f"🎯 代理目标 URL: {self.config.target_base_url}")
+        self.capture_policy = CapturePolicyLoader(self.config.capture_policy_file)
+        if self.config.upstreams_file:
+            self.upstream_pool = UpstreamPool.from_file(self.config.upstreams_file)
+            print(f"🎯 代理目标上游池 ({self.upstream_pool.config.strategy}):")
+            for upstream in self.upstream_pool.upstreams:
+                print(f"   - {upstream.url} (并发上限: {upstream.config.max_concurrency})")
+        else:
+            self.upstream_pool = UpstreamPool.single(self.config.target_base_url)
+            print(f"🎯 代理目标 URL: {self.config.target_base_url}")
         
-    async def log_request(self, log_data: RequestLog):
+    async def log_request(self, log_data: RequestLog, decision: Optional[CaptureDecision] = None):
         """保存请求日志"""
         if not self.config.enable_logging:
             return
+        
+        if decision is not None:
+            if decision.level == "none":
+                return
+            self.apply_capture_decision(log_data, decision)
             
         log_file = self.config.log_dir / f"{log_data.id}.json"
         with open(log_file, 'w', encoding='utf-8') as f:
             json.dump(log_data.model_dump(), f, ensure_ascii=False, indent=2, default=str)
+        # 记录新日志，检索索引据此增量更新
+        append_journal(self.config.log_dir, log_file.name)
+    
+    def apply_capture_decision(self, log_data: RequestLog, decision: CaptureDecision):
+        """按采集决策裁剪日志内容"""
+        log_data.capture_level = decision.level
+        log_data.headers = decision.filter_headers(log_data.headers)
+        if log_data.response_headers is not None:
+            log_data.response_headers = decision.filter_headers(log_data.response_headers)
+        
+        if decision.level == "metadata":
+            log_data.body = None
+            log_data.response_body = None
+            log_data.response_chunks = []
+            return
+        
+        limit = decision.max_body_bytes
+        if limit is None:
+            return
+        for field in ("body", "response_body"):
+            value = getattr(log_data, field)
+            if value is None:
+                continue
+            raw = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+            encoded = raw.encode('utf-8')
+            if len(encoded) > limit:
+                setattr(log_data, field, encoded[:limit].decode('utf-8', errors='ignore'))
+                log_data.truncated = True
+    
+    async def send_with_failover(
+        self,
+        request: Request,
+        headers: Dict[str, str],
+        body: bytes,
+        log_data: RequestLog
+    ) -> Tuple[Upstream, httpx.Response]:
+        """按路由策略选择上游发送请求，建立连接失败或返回可重试状态码时换一个上游重试"""
+        tried = []
+        while True:
+            upstream = await self.upstream_pool.acquire(exclude=tried)
+            tried.append(upstream)
+            attempt_start = time.time()
+            try:
+                upstream_request = self.client.build_request(
+                    method=request.method,
+                    url=upstream.build_url(request.url.path, request.url.query),
+                    headers=upstream.apply_headers(headers),
+                    content=body
+                )
+                response = await self.client.send(
+                    upstream_request, stream=True, follow_redirects=True
+                )
+            except httpx.TransportError as e:
+                self.upstream_pool.record_failure(upstream)
+                await self.upstream_pool.release(upstream)
+                log_data.upstream_attempts.append({"upstream": upstream.url, "error": str(e)})
+                # 上游可能已经收到请求，只有连接阶段的错误才换一个上游重试
+                if isinstance(e, RETRYABLE_TRANSPORT_ERRORS) and self.upstream_pool.can_retry(tried):
+                    continue
+                raise
+            except BaseException:
+                # 包括请求任务被取消的情况，名额必须归还
+                await self.upstream_pool.release(upstream)
+                raise
+            
+            latency_ms = (time.time() - attempt_start) * 1000
+            self.upstream_pool.record_response(upstream, response.status_code, latency_ms)
+            log_data.upstream_attempts.append({
+                "upstream": upstream.url,
+                "status": response.status_code,
+                "latency_ms": latency_ms
+            })
+            
+            # 尚未向客户端发送任何数据，可以安全地换一个上游
+            if response.status_code in RETRYABLE_STATUS_CODES and self.upstream_pool.can_retry(tried):
+                await self.upstream_pool.release(upstream)
+                await response.aclose()
+                continue
+            
+            log_data.upstream = upstream.url
+            return upstream, response
     
     async def proxy_request(self, request: Request) -> Response:
         """代理请求到目标 API"""
@@ -65,6 +220,8 @@ class LLMProxy:
             except:
                 body_json = body.decode('utf-8', errors='ignore')
         
+        model = body_json.get("model") if isinstance(body_json, dict) else None
+        
         # 构建请求日志
         log_data = RequestLog(
             id=request_id,
@@ -72,13 +229,10 @@ class LLMProxy:
             method=request.method,
             path=str(request.url.path),
             headers=dict(request.headers),
-            body=body_json
+            body=body_json,
+            model=model if isinstance(model, str) else None
         )
-        
-        # 构建目标 URL
-        target_url = f"{self.config.target_base_url}{request.url.path}"
-        if request.url.query:
-            target_url += f"?{request.url.query}"
+        capture_policy = self.capture_policy.current()
         
         # 转发请求头（排除 host 相关）
         headers = {}
@@ -86,52 +240,86 @@ class LLMProxy:
             if key.lower() not in ['host', 'content-length']:
                 headers[key] = value
         
+        upstream = None
+        response = None
+        released = False
+        
+        async def release_upstream():
+            """释放上游并发名额并关闭上游响应，可重复调用"""
+            nonlocal released
+            if released or upstream is None:
+                return
+            released = True
+            await self.upstream_pool.release(upstream)
+            await response.aclose()
+        
         try:
             # 发送请求到目标 API
-            response = await self.client.request(
-                method=request.method,
-                url=target_url,
-                headers=headers,
-                content=body,
-                follow_redirects=True
-            )
+            upstream, response = await self.send_with_failover(request, headers, body, log_data)
             
             # 记录响应信息
             log_data.response_status = response.status_code
             log_data.response_headers = dict(response.headers)
+            decision = capture_policy.evaluate(log_data.path, log_data.model, response.status_code)
             
             # 检查是否是流式响应
             is_stream = 'text/event-stream' in response.headers.get('content-type', '')
+            log_data.stream = is_stream
             
             if is_stream:
                 # 处理流式响应
                 async def stream_generator():
                     chunks = []
-                    async for chunk in response.aiter_bytes():
-                        chunks.append(chunk.decode('utf-8', errors='ignore'))
-                        yield chunk
-                    
-                    # 保存所有块
-                    log_data.response_chunks = chunks
-                    log_data.duration_ms = (time.time() - start_time) * 1000
-                    await self.log_request(log_data)
+                    captured_bytes = 0
+                    limit = decision.max_body_bytes
+                    usage_parser = SSEUsageParser()
+                    try:
+                        async for chunk in response.aiter_bytes():
+                            # 无论采集级别和大小上限如何都解析 token 用量
+                            usage_parser.feed(chunk)
+                            # 仅在完整采集时缓存数据块，超出大小上限后停止缓存
+                            if decision.level == "full":
+                                if limit is None or captured_bytes < limit:
+                                    chunks.append(chunk.decode('utf-8', errors='ignore'))
+                                    captured_bytes += len(chunk)
+                                else:
+                                    log_data.truncated = True
+                            yield chunk
+                        
+                        # 保存所有块
+                        usage_parser.close()
+                        log_data.usage = usage_parser.usage
+                        log_data.response_chunks = chunks
+                        log_data.duration_ms = (time.time() - start_time) * 1000
+                        await self.log_request(log_data, decision)
+                    finally:
+                        # 流结束后才释放上游的并发名额
+                        await release_upstream()
                 
-                return StreamingResponse(
+                # 生成器未被迭代（如客户端提前断开）时由 background 释放
+                return UpstreamStreamingResponse(
                     stream_generator(),
                     status_code=response.status_code,
                     headers=dict(response.headers),
-                    media_type=response.headers.get('content-type')
+                    media_type=response.headers.get('content-type'),
+                    background=BackgroundTask(release_upstream)
                 )
             else:
                 # 处理普通响应
+                try:
+                    await response.aread()
+                finally:
+                    await release_upstream()
                 response_body = response.text
                 try:
                     log_data.response_body = json.loads(response_body)
                 except:
                     log_data.response_body = response_body
+                if isinstance(log_data.response_body, dict) and isinstance(log_data.response_body.get("usage"), dict):
+                    log_data.usage = log_data.response_body["usage"]
                 
                 log_data.duration_ms = (time.time() - start_time) * 1000
-                await self.log_request(log_data)
+                await self.log_request(log_data, decision)
                 
                 return Response(
                     content=response_body,
@@ -141,10 +329,13 @@ class LLMProxy:
                 )
                 
         except Exception as e:
+            await release_upstream()
             log_data.response_status = 500
             log_data.response_body = {"error": str(e)}
             log_data.duration_ms = (time.time() - start_time) * 1000
-            await self.log_request(log_data)
+            await self.log_request(
+                log_data, capture_policy.evaluate(log_data.path, log_data.model, 500)
+            )
             
             raise HTTPException(status_code=500, detail=str(e))
 
@@ -160,10 +351,19 @@ async def startup_event():
     global llm_proxy
     # 此时环境变量已经设置
     proxy_config = ProxyConfig(
-        target_base_url=os.getenv("TARGET_BASE_URL", "https://api.openai.com")
+        target_base_url=os.getenv("TARGET_BASE_URL", "https://api.openai.com"),
+        capture_policy_file=os.getenv("CAPTURE_POLICY_FILE"),
+        upstreams_file=os.getenv("UPSTREAMS_FILE")
     )
     llm_proxy = LLMProxy(proxy_config)
 
+@app.get("/_proxy/upstreams")
+async def upstream_stats():
+    """上游池统计信息（需在通用代理端点之前注册）"""
+    if llm_proxy is None:
+        raise HTTPException(status_code=500, detail="Proxy not initialized")
+    return llm_proxy.upstream_pool.snapshot()
+
 @app.api_route("/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "OPTIONS"])
 async def proxy_endpoint(request: Request, path: str):
     """通用代理端点"""
@@ -0,0 +1,39 @@
+"""
+日志写入记录
+代理每写完一个日志文件就把文件名追加到日志目录下的记录文件，
+检索索引等消费者从上次读到的位置继续读取即可得到新日志，不需要扫描整个目录
+"""
+import os
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+JOURNAL_NAME = "journal.log"
+
+
+def append_journal(log_dir: Path, file_name: str):
+    """追加一条记录，需在日志文件完整写入之后调用"""
+    # 追加模式下单行写入是原子的，多个代理进程可以同时写入
+    with open(log_dir / JOURNAL_NAME, 'ab') as f:
+        f.write(f"{file_name}\n".encode('utf-8'))
+
+
+def journal_identity(log_dir: Path) -> Optional[Tuple[str, int]]:
+    """返回记录文件的 (设备:inode, 大小)，用于判断文件是否被删除重建；不存在时返回 None"""
+    try:
+        stat = os.stat(log_dir / JOURNAL_NAME)
+    except FileNotFoundError:
+        return None
+    return f"{stat.st_dev}:{stat.st_ino}", stat.st_size
+
+
+def read_journal(log_dir: Path, offset: int, max_bytes: int = -1) -> Tuple[List[str], int]:
+    """读取 offset 之后的完整记录，返回 (文件名列表, 新的 offset)，末尾未写完的一行留到下次读取"""
+    try:
+        with open(log_dir / JOURNAL_NAME, 'rb') as f:
+            f.seek(offset)
+            data = f.read(max_bytes)
+    except FileNotFoundError:
+        return [], offset
+    end = data.rfind(b"\n") + 1
+    names = [line for line in data[:end].decode('utf-8', errors='ignore').split("\n") if line]
+    return names, offset + end
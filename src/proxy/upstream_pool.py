@@ -0,0 +1,163 @@
+"""
+上游目标池
+在多个上游 API 之间按最少未完成请求数或延迟 EWMA 选择目标，支持并发上限和故障转移
+"""
+import asyncio
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Literal, Optional
+import httpx
+from pydantic import BaseModel, Field
+
+# 这些状态码在尚未向客户端发送数据时可以换一个上游重试
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# 只有这些错误能确定上游尚未收到请求，其他传输错误（读超时、协议错误等）重试可能导致重复请求
+RETRYABLE_TRANSPORT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+class UpstreamConfig(BaseModel):
+    """单个上游目标配置"""
+    url: str
+    api_key: Optional[str] = None  # 设置后替换客户端的 Authorization 头
+    max_concurrency: int = Field(64, ge=1)
+
+
+class UpstreamPoolConfig(BaseModel):
+    """上游池配置"""
+    upstreams: List[UpstreamConfig] = Field(min_length=1)
+    strategy: Literal["least_outstanding", "ewma"] = "least_outstanding"
+    max_attempts: int = Field(3, ge=1)  # 单个请求最多尝试的上游数
+    ewma_alpha: float = Field(0.3, gt=0.0, le=1.0)
+    failure_cooldown: float = Field(5.0, ge=0.0)  # 失败后降低优先级的秒数
+
+
+class Upstream:
+    """上游目标及其运行时统计"""
+
+    def __init__(self, config: UpstreamConfig):
+        self.config = config
+        self.url = config.url.rstrip("/")
+        self.outstanding = 0
+        self.total_requests = 0
+        self.failures = 0
+        self.status_counts: Dict[int, int] = {}
+        self.ewma_latency_ms: Optional[float] = None
+        self.cooldown_until = 0.0
+
+    def build_url(self, path: str, query: str) -> str:
+        """构建目标 URL"""
+        url = f"{self.url}{path}"
+        if query:
+            url += f"?{query}"
+        return url
+
+    def apply_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
+        """按上游配置替换认证头"""
+        if not self.config.api_key:
+            return headers
+        headers = {k: v for k, v in headers.items() if k.lower() != "authorization"}
+        headers["Authorization"] = f"Bearer {self.config.api_key}"
+        return headers
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出统计信息"""
+        return {
+            "url": self.url,
+            "outstanding": self.outstanding,
+            "max_concurrency": self.config.max_concurrency,
+            "total_requests": self.total_requests,
+            "failures": self.failures,
+            "status_counts": self.status_counts,
+            "ewma_latency_ms": self.ewma_latency_ms,
+            "cooling_down": self.cooldown_until > time.monotonic()
+        }
+
+
+class UpstreamPool:
+    """上游目标池"""
+
+    def __init__(self, config: UpstreamPoolConfig):
+        self.config = config
+        self.upstreams = [Upstream(u) for u in config.upstreams]
+        self._condition = asyncio.Condition()
+
+    @classmethod
+    def from_file(cls, pool_file: Path) -> "UpstreamPool":
+        """从 JSON 文件加载上游池配置"""
+        with open(pool_file, 'r', encoding='utf-8') as f:
+            return cls(UpstreamPoolConfig.model_validate(json.load(f)))
+
+    @classmethod
+    def single(cls, url: str) -> "UpstreamPool":
+        """只有一个上游的池，行为与单一 target_base_url 相同"""
+        return cls(UpstreamPoolConfig(
+            upstreams=[UpstreamConfig(url=url, max_concurrency=10_000)],
+            max_attempts=1
+        ))
+
+    def _score(self, upstream: Upstream) -> float:
+        """选择得分，越小越优先"""
+        if self.config.strategy == "ewma":
+            # 未完成请求越多预期等待越久，没有样本的上游优先被探测
+            return (upstream.ewma_latency_ms or 0.0) * (upstream.outstanding + 1)
+        return upstream.outstanding
+
+    def _pick(self, candidates: List[Upstream]) -> Upstream:
+        """优先选择不在冷却期的上游"""
+        now = time.monotonic()
+        healthy = [u for u in candidates if u.cooldown_until <= now]
+        return min(healthy or candidates, key=self._score)
+
+    def can_retry(self, tried: List[Upstream]) -> bool:
+        """是否还能换一个上游重试"""
+        return len(tried) < self.config.max_attempts and any(
+            u not in tried for u in self.upstreams
+        )
+
+    async def acquire(self, exclude: List[Upstream]) -> Optional[Upstream]:
+        """选择一个上游并占用一个并发名额，所有上游都已满时等待"""
+        async with self._condition:
+            while True:
+                candidates = [u for u in self.upstreams if u not in exclude]
+                if not candidates:
+                    return None
+                available = [u for u in candidates if u.outstanding < u.config.max_concurrency]
+                if available:
+                    upstream = self._pick(available)
+                    upstream.outstanding += 1
+                    upstream.total_requests += 1
+                    return upstream
+                await self._condition.wait()
+
+    async def release(self, upstream: Upstream):
+        """释放并发名额"""
+        # 先减计数再等待锁，即使调用方在此处被取消名额也不会泄漏
+        upstream.outstanding -= 1
+        async with self._condition:
+            self._condition.notify_all()
+
+    def record_response(self, upstream: Upstream, status: int, latency_ms: float):
+        """记录上游响应状态和首字节延迟"""
+        upstream.status_counts[status] = upstream.status_counts.get(status, 0) + 1
+        if upstream.ewma_latency_ms is None:
+            upstream.ewma_latency_ms = latency_ms
+        else:
+            alpha = self.config.ewma_alpha
+            upstream.ewma_latency_ms = alpha * latency_ms + (1 - alpha) * upstream.ewma_latency_ms
+        if status in RETRYABLE_STATUS_CODES:
+            self.record_failure(upstream)
+
+    def record_failure(self, upstream: Upstream):
+        """记录失败，冷却期内该上游优先级降低"""
+        upstream.failures += 1
+        upstream.cooldown_until = time.monotonic() + self.config.failure_cooldown
+
+    def snapshot(self) -> Dict[str, Any]:
+        """导出整个池的统计信息"""
+        return {
+            "strategy": self.config.strategy,
+            "max_attempts": self.config.max_attempts,
+            "upstreams": [u.snapshot() for u in self.upstreams]
+        }
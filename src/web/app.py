@@ -2,17 +2,26 @@
 Web 界面应用
 用于展示 LLM 代理和 MCP 服务的交互数据
 """
+import asyncio
 import json
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from datetime import datetime
 from typing import List, Dict, Any, Optional
-from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, Query
+from fastapi.responses import HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
 import aiofiles
 
+from src.export.columnar import (
+    create_export_executor, list_log_files, require_pyarrow, stream_export
+)
+from src.web.search_index import SearchIndex
+
 class LogEntry(BaseModel):
     """日志条目"""
     id: str
@@ -29,8 +38,44 @@ class WebApp:
         # 挂载静态文件
         self.app.mount("/static", StaticFiles(directory="static"), name="static")
         
+        # 全文检索索引
+        self.search_index = SearchIndex(
+            db_path=Path("logs/search_index.db"),
+            llm_log_dir=Path("logs/llm_proxy"),
+            mcp_log_dir=Path("logs/mcp_weather"),
+            llm_parser=self.parse_llm_log
+        )
+        
+        # 流式导出共享的进程池，首次导出时创建，随应用关闭
+        self.export_workers = os.cpu_count() or 1
+        self.export_executor: Optional[ProcessPoolExecutor] = None
+        self._export_executor_lock = threading.Lock()
+        
         # 设置路由
         self.setup_routes()
+        
+        @self.app.on_event("startup")
+        async def startup_event():
+            """启动后台索引线程"""
+            self.search_index.start()
+        
+        @self.app.on_event("shutdown")
+        async def shutdown_event():
+            """停止后台索引线程并关闭导出进程池"""
+            self.search_index.close()
+            if self.export_executor is not None:
+                # 取消排队中的批次，在线程中等待子进程退出，不阻塞事件循环
+                await asyncio.to_thread(self.export_executor.shutdown, wait=True, cancel_futures=True)
+    
+    def get_export_executor(self) -> ProcessPoolExecutor:
+        """获取导出进程池，首次调用时创建（需在线程中调用）"""
+        with self._export_executor_lock:
+            if self.export_executor is None:
+                executor = create_export_executor(self.export_workers)
+                # 启动第一个子进程时需等待 forkserver 导入主模块，放在线程中避免阻塞事件循环
+                executor.submit(os.getpid).result()
+                self.export_executor = executor
+            return self.export_executor
     
     def setup_routes(self):
         """设置路由"""
@@ -134,6 +179,53 @@ class WebApp:
             
             return [log.model_dump() for log in sorted(logs, key=lambda x: x.timestamp, reverse=True)[:50]]
         
+        @self.app.get("/api/search")
+        async def search_logs(
+            q: str,
+            page: int = Query(1, ge=1),
+            page_size: int = Query(20, ge=1, le=100),
+            type: Optional[str] = Query(None, pattern="^(llm|mcp)$")
+        ):
+            """全文检索对话内容、生成内容和 MCP 工具调用"""
+            return await asyncio.to_thread(
+                self.search_index.search, q, page, page_size, type
+            )
+        
+        @self.app.get("/api/export")
+        async def export_logs(
+            format: str = Query("arrow", pattern="^(arrow|parquet)$"),
+            include_text: bool = False,
+            since_mtime: Optional[float] = None,
+            since_name: str = ""
+        ):
+            """流式导出 LLM 日志为 Arrow IPC / Parquet，可从上次的游标继续导出"""
+            try:
+                require_pyarrow()
+            except RuntimeError as e:
+                return {"error": str(e)}
+            cursor = (since_mtime, since_name) if since_mtime is not None else None
+            files = await asyncio.to_thread(list_log_files, Path("logs/llm_proxy"), cursor)
+            
+            # 游标指向本次导出的最后一个文件，下次请求时作为 since_mtime / since_name 传回
+            headers = {"Content-Disposition": f"attachment; filename=llm_logs.{format}"}
+            if files:
+                last_mtime, last_name = files[-1][0]
+                headers["X-Export-Cursor"] = json.dumps({"mtime": last_mtime, "name": last_name})
+            
+            executor = await asyncio.to_thread(self.get_export_executor)
+            media_type = (
+                "application/vnd.apache.arrow.stream" if format == "arrow"
+                else "application/vnd.apache.parquet"
+            )
+            return StreamingResponse(
+                stream_export(
+                    [p for _, p in files], executor, self.export_workers,
+                    format, include_text
+                ),
+                media_type=media_type,
+                headers=headers
+            )
+        
         @self.app.get("/api/log/{log_type}/{log_id}")
         async def get_log_detail(log_type: str, log_id: str):
             """获取日志详情"""
@@ -196,7 +288,7 @@ class WebApp:
         }
         
         # 解析请求信息
-        if data.get("body"):
+        if isinstance(data.get("body"), dict):
             body = data["body"]
             parsed["request_info"] = {
                 "model": body.get("model"),
@@ -226,6 +318,10 @@ class WebApp:
                         "content_length": len(str(content))
                     })
         
+        # 顶层字段在 metadata 级别和截断时同样保留
+        if data.get("stream") is not None:
+            parsed["request_info"]["stream"] = data["stream"]
+        
         # 解析响应信息
         if data.get("response_status"):
             parsed["response_info"]["status"] = data["response_status"]
@@ -291,8 +387,11 @@ class WebApp:
             if usage_info:
                 parsed["response_content"]["usage"] = usage_info
         
+        if not parsed["response_content"].get("usage") and isinstance(data.get("usage"), dict):
+            parsed["response_content"]["usage"] = data["usage"]
+        
         # 解析模型信息
-        if data.get("body", {}).get("model"):
+        if isinstance(data.get("body"), dict) and data["body"].get("model"):
             model = data["body"]["model"]
             parsed["model_info"] = {
                 "model_name": model,
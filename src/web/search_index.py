@@ -0,0 +1,530 @@
+"""
+日志全文检索
+基于 SQLite FTS5 为 LLM 对话内容和 MCP 工具调用建立倒排索引
+"""
+import html
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
+
+from src.proxy.log_journal import journal_identity, read_journal
+
+# 索引结构版本，结构变化时重建索引
+SCHEMA_VERSION = 3
+
+# 检索结果总数的统计上限，避免常见词 count(*) 扫描全部匹配
+TOTAL_CAP = 1000
+
+# 每处理多少个文件提交一次，首次索引大量日志时检索可以尽早看到结果
+COMMIT_EVERY = 500
+
+# 高亮片段前后保留的字符数
+SNIPPET_RADIUS = 40
+
+# 高亮标记，转义 HTML 后再替换为 <mark>
+HIGHLIGHT_START = "\x02"
+HIGHLIGHT_END = "\x03"
+
+# 中日韩文字没有空格分词，短词需要单独建立单字 / 双字 token
+CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+CJK_RUN = re.compile(f"[{CJK_CHARS}]+")
+NON_CJK_WORD = re.compile(f"[^\\W{CJK_CHARS}]+")
+
+
+def short_tokens(text: str) -> List[str]:
+    """提取短词索引的 token：中日韩文字的单字和相邻双字，以及其他不超过 2 个字符的词"""
+    tokens = set()
+    for run in CJK_RUN.findall(text):
+        tokens.update(run)
+        tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    for word in NON_CJK_WORD.findall(text):
+        if len(word) <= 2:
+            tokens.add(word.lower())
+    return sorted(tokens)
+
+
+def short_token_text(text: str) -> str:
+    """短词 token 以空格分隔并在首尾补空格，trigram 索引中检索 " token " 即为整词匹配"""
+    tokens = short_tokens(text)
+    return f" {' '.join(tokens)} " if tokens else ""
+
+
+class SearchIndex:
+    """日志全文索引
+
+    后台线程增量同步日志，查询本身不触发同步：
+    - LLM 日志从代理写入的记录文件（见 log_journal）读取新文件名，不扫描目录；
+      启动时和每隔 reconcile_interval 秒核对一次目录，移除已删除的日志并补充不在记录中的日志
+    - MCP 日志会被追加写入，每次同步按 mtime 检查（每个会话一个文件，数量远少于 LLM 日志）
+    """
+
+    def __init__(
+        self,
+        db_path: Path,
+        llm_log_dir: Path,
+        mcp_log_dir: Path,
+        llm_parser: Callable[[Dict[str, Any]], Dict[str, Any]],
+        sync_interval: float = 2.0,
+        reconcile_interval: float = 600.0
+    ):
+        self.db_path = db_path
+        self.llm_log_dir = llm_log_dir
+        self.mcp_log_dir = mcp_log_dir
+        self.llm_parser = llm_parser
+        self.sync_interval = sync_interval
+        self.reconcile_interval = reconcile_interval
+        self._last_reconcile: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._write_lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self.conn: Optional[sqlite3.Connection] = None
+        self.read_conn: Optional[sqlite3.Connection] = None
+
+    def open(self):
+        """打开数据库连接并建表
+
+        连接不在构造时打开，导入应用模块（如进程池子进程导入主模块）时不会创建 SQLite 连接
+        """
+        if self.conn is not None:
+            return
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # 写连接由索引线程使用，读连接供查询使用；WAL 模式下读写互不阻塞
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self._create_tables()
+        self.read_conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+
+    def _create_tables(self):
+        """创建索引表，结构版本不一致时重建"""
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS indexed_files;
+                DROP TABLE IF EXISTS index_state;
+                DROP TABLE IF EXISTS documents;
+                DROP TABLE IF EXISTS documents_fts;
+                DROP TABLE IF EXISTS documents_short;
+            """)
+
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS indexed_files (
+                path TEXT PRIMARY KEY,
+                mtime REAL NOT NULL
+            );
+            -- 记录文件的读取位置等同步状态
+            CREATE TABLE IF NOT EXISTS index_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS documents (
+                rowid INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                log_id TEXT NOT NULL,
+                log_type TEXT NOT NULL,
+                timestamp TEXT,
+                summary TEXT
+            );
+            CREATE INDEX IF NOT EXISTS idx_documents_source ON documents(source);
+        """)
+        # 短词 token 和日志类型与正文放在同一个 FTS 表中，混合查询由一次 MATCH 完成，
+        # FTS5 内部按 rowid 合并各词的倒排列表，不需要跨表连接
+        self.trigram = True
+        try:
+            # trigram 分词器支持中文等无空格文本的子串匹配（SQLite >= 3.34）
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts "
+                "USING fts5(prompt, completion, tokens, kind, tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            self.trigram = False
+            self.conn.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts "
+                "USING fts5(prompt, completion, tokens, kind)"
+            )
+        self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self.conn.commit()
+
+    def start(self):
+        """打开数据库并启动后台索引线程"""
+        if self._thread is not None:
+            return
+        self.open()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="search-indexer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止后台索引线程"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _run(self):
+        """后台索引循环"""
+        while not self._stop.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"Error syncing search index: {e}")
+            self._stop.wait(self.sync_interval)
+
+    def sync(self) -> int:
+        """增量同步日志，返回本次（重新）索引或移除的文件数"""
+        with self._write_lock:
+            changed = 0
+            journal_id, journal_size = journal_identity(self.llm_log_dir) or ("", 0)
+            offset = int(self._get_state("journal_offset") or 0)
+            if self._get_state("journal_id") != journal_id or journal_size < offset:
+                # 首次同步或记录文件被重建：此前写入的日志由目录核对覆盖，从记录文件当前末尾开始读取
+                offset = journal_size
+                self._last_reconcile = None
+
+            now = time.monotonic()
+            if self._last_reconcile is None or now - self._last_reconcile >= self.reconcile_interval:
+                changed += self._reconcile_llm_logs()
+                self._last_reconcile = now
+            self._set_state("journal_id", journal_id)
+            self._set_state("journal_offset", offset)
+
+            while not self._stop.is_set():
+                names, next_offset = read_journal(self.llm_log_dir, offset, max_bytes=1 << 20)
+                if next_offset == offset:
+                    break
+                offset = next_offset
+                changed += self._index_files(
+                    (os.path.join(self.llm_log_dir, name) for name in names),
+                    self._extract_llm_documents
+                )
+                self._set_state("journal_offset", offset)
+                self.conn.commit()
+
+            changed += self._sync_mcp_logs()
+            self.conn.commit()
+            return changed
+
+    def _get_state(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM index_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_state(self, key: str, value: Any):
+        self.conn.execute(
+            "INSERT OR REPLACE INTO index_state (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def _indexed_paths(self, log_dir: Path) -> sqlite3.Cursor:
+        """按主键范围查询某个目录下已索引的文件"""
+        prefix = os.path.join(log_dir, "")
+        return self.conn.execute(
+            "SELECT path, mtime FROM indexed_files WHERE path >= ? AND path < ?",
+            (prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1))
+        )
+
+    def _reconcile_llm_logs(self) -> int:
+        """核对 LLM 日志目录：只列出文件名而不逐个 stat，移除已删除的日志并索引尚未索引的日志"""
+        if not self.llm_log_dir.exists():
+            return 0
+        names = {entry.path for entry in os.scandir(self.llm_log_dir) if entry.name.endswith(".json")}
+        deleted = []
+        for path, _ in self._indexed_paths(self.llm_log_dir):
+            if path in names:
+                names.discard(path)
+            else:
+                deleted.append(path)
+        for path in deleted:
+            self._delete_documents(path)
+            self.conn.execute("DELETE FROM indexed_files WHERE path = ?", (path,))
+        return len(deleted) + self._index_files(names, self._extract_llm_documents)
+
+    def _sync_mcp_logs(self) -> int:
+        """按 mtime 同步 MCP 日志目录"""
+        known = dict(self._indexed_paths(self.mcp_log_dir))
+        seen = set()
+        changed = []
+        if self.mcp_log_dir.exists():
+            for entry in os.scandir(self.mcp_log_dir):
+                if not entry.name.endswith(".jsonl"):
+                    continue
+                seen.add(entry.path)
+                try:
+                    if known.get(entry.path) != entry.stat().st_mtime:
+                        changed.append(entry.path)
+                except OSError:
+                    continue
+        deleted = known.keys() - seen
+        for path in deleted:
+            self._delete_documents(path)
+            self.conn.execute("DELETE FROM indexed_files WHERE path = ?", (path,))
+        return len(deleted) + self._index_files(changed, self._extract_mcp_documents)
+
+    def _index_files(
+        self,
+        paths: Iterable[str],
+        extract: Callable[[Path], List[Dict[str, str]]]
+    ) -> int:
+        """（重新）索引 mtime 与索引中记录不一致的文件，返回处理的文件数"""
+        pending = []
+        for path in paths:
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            row = self.conn.execute(
+                "SELECT mtime FROM indexed_files WHERE path = ?", (path,)
+            ).fetchone()
+            if row is None or row[0] != mtime:
+                pending.append((mtime, path))
+
+        # 按写入时间顺序索引，rowid 近似时间顺序，检索时按 rowid 倒序即最新优先
+        pending.sort()
+        changed = 0
+        for mtime, path in pending:
+            if self._stop.is_set():
+                break
+            try:
+                documents = extract(Path(path))
+            except Exception as e:
+                # 同样记录 mtime，避免每次同步都重复解析；文件写完后 mtime 变化会重新索引
+                print(f"Error indexing log file {path}: {e}")
+                documents = []
+            self._replace_documents(path, mtime, documents)
+            changed += 1
+            if changed % COMMIT_EVERY == 0:
+                self.conn.commit()
+        return changed
+
+    def _delete_documents(self, source: str):
+        """删除某个日志文件对应的全部文档"""
+        self.conn.execute(
+            "DELETE FROM documents_fts WHERE rowid IN (SELECT rowid FROM documents WHERE source = ?)",
+            (source,)
+        )
+        self.conn.execute("DELETE FROM documents WHERE source = ?", (source,))
+
+    def _replace_documents(self, source: str, mtime: float, documents: List[Dict[str, str]]):
+        """替换某个日志文件对应的全部文档"""
+        self._delete_documents(source)
+
+        for doc in documents:
+            cursor = self.conn.execute(
+                "INSERT INTO documents (source, log_id, log_type, timestamp, summary) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (source, doc["log_id"], doc["log_type"], doc["timestamp"], doc["summary"])
+            )
+            # 非 trigram 索引可以直接匹配短词，不需要短词 token
+            tokens = short_token_text(f"{doc['prompt']}\n{doc['completion']}") if self.trigram else ""
+            self.conn.execute(
+                "INSERT INTO documents_fts (rowid, prompt, completion, tokens, kind) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (cursor.lastrowid, doc["prompt"], doc["completion"], tokens, doc["log_type"])
+            )
+
+        self.conn.execute(
+            "INSERT OR REPLACE INTO indexed_files (path, mtime) VALUES (?, ?)",
+            (source, mtime)
+        )
+
+    def _extract_llm_documents(self, log_file: Path) -> List[Dict[str, str]]:
+        """从 LLM 日志中提取对话与生成内容"""
+        with open(log_file, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        parsed = self.llm_parser(data)
+        prompt = "\n".join(
+            f"{msg['role']}: {msg['content']}" for msg in parsed["conversation"]
+        )
+
+        completion = parsed["response_content"].get("generated_text", "")
+        body = parsed["response_content"].get("body")
+        if not completion and isinstance(body, dict):
+            # 非流式响应：从 choices 中提取回复内容
+            parts = []
+            for choice in body.get("choices", []) or []:
+                content = (choice.get("message") or {}).get("content")
+                if isinstance(content, str):
+                    parts.append(content)
+            completion = "\n".join(parts)
+        elif not completion and body:
+            completion = str(body)
+
+        summary = f"{data.get('method')} {data.get('path')}"
+        model = parsed["request_info"].get("model")
+        if model:
+            summary += f" (model: {model})"
+
+        return [{
+            "log_id": data.get("id", log_file.stem),
+            "log_type": "llm",
+            "timestamp": str(data.get("timestamp", "")),
+            "summary": summary,
+            "prompt": prompt,
+            "completion": completion
+        }]
+
+    def _extract_mcp_documents(self, log_file: Path) -> List[Dict[str, str]]:
+        """从 MCP 日志中提取工具调用参数与结果"""
+        documents = []
+        with open(log_file, 'r', encoding='utf-8') as f:
+            lines = [line for line in f if line.strip()]
+
+        for i, line in enumerate(lines):
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            message = entry.get("message", {})
+            method = message.get("method")
+
+            if method == "tools/call":
+                params = message.get("params", {})
+                summary = f"MCP: Call {params.get('name', '')}"
+                prompt = json.dumps(params, ensure_ascii=False)
+                completion = ""
+            elif "result" in message or "error" in message:
+                summary = "MCP: response"
+                prompt = ""
+                completion = json.dumps(
+                    message.get("result", message.get("error")), ensure_ascii=False
+                )
+            else:
+                continue
+
+            documents.append({
+                "log_id": f"{entry.get('session_id')}_{i}",
+                "log_type": "mcp",
+                "timestamp": str(entry.get("timestamp", "")),
+                "summary": summary,
+                "prompt": prompt,
+                "completion": completion
+            })
+        return documents
+
+
+    def search(
+        self,
+        query: str,
+        page: int = 1,
+        page_size: int = 20,
+        log_type: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """检索日志，按最新优先返回带高亮片段的分页结果"""
+        terms = [t for t in query.split() if t]
+        empty = {
+            "query": query, "total": 0, "total_capped": False,
+            "page": page, "page_size": page_size, "results": []
+        }
+        if not terms:
+            return empty
+
+        # trigram 索引无法匹配少于 3 个字符的词，这些词改为匹配短词 token
+        if self.trigram:
+            indexed_terms = [t for t in terms if len(t) >= 3]
+            short_terms = [t for t in terms if len(t) < 3]
+        else:
+            indexed_terms, short_terms = terms, []
+
+        short_query = []
+        for term in short_terms:
+            tokens = short_tokens(term)
+            if not tokens:
+                return empty
+            # 双字 token 已经隐含其中的单字，只保留最长的 token
+            short_query.extend(
+                f" {t} " for t in tokens if not any(t != u and t in u for u in tokens)
+            )
+
+        # 所有条件在同一个 FTS 索引内求值，按 rowid 倒序扫描，命中 LIMIT 后即可停止
+        conditions = []
+        if indexed_terms:
+            conditions.append("{prompt completion} : (" + self._build_match_expression(indexed_terms) + ")")
+        if short_query:
+            conditions.append("tokens : (" + self._build_match_expression(short_query) + ")")
+        if log_type:
+            conditions.append("kind : " + self._build_match_expression([log_type]))
+        match = " AND ".join(conditions)
+
+        with self._read_lock:
+            total = self.read_conn.execute(
+                "SELECT count(*) FROM (SELECT 1 FROM documents_fts WHERE documents_fts MATCH ? LIMIT ?)",
+                (match, TOTAL_CAP)
+            ).fetchone()[0]
+            rowids = [row[0] for row in self.read_conn.execute(
+                "SELECT rowid FROM documents_fts WHERE documents_fts MATCH ? "
+                "ORDER BY rowid DESC LIMIT ? OFFSET ?",
+                (match, page_size, (page - 1) * page_size)
+            )]
+            placeholders = ",".join("?" * len(rowids))
+            documents = {
+                row[0]: row[1:] for row in self.read_conn.execute(
+                    "SELECT d.rowid, d.log_id, d.log_type, d.timestamp, d.summary, f.prompt, f.completion "
+                    "FROM documents d JOIN documents_fts f ON f.rowid = d.rowid "
+                    f"WHERE d.rowid IN ({placeholders})",
+                    rowids
+                )
+            } if rowids else {}
+
+        results = []
+        for rowid in rowids:
+            if rowid not in documents:
+                continue
+            log_id, doc_type, timestamp, summary, prompt, completion = documents[rowid]
+            results.append({
+                "id": log_id,
+                "type": doc_type,
+                "timestamp": timestamp,
+                "summary": summary,
+                "prompt_snippet": self._make_snippet(prompt, terms),
+                "completion_snippet": self._make_snippet(completion, terms)
+            })
+
+        return {
+            "query": query,
+            "total": total,
+            "total_capped": total >= TOTAL_CAP,
+            "page": page,
+            "page_size": page_size,
+            "results": results
+        }
+
+    @staticmethod
+    def _build_match_expression(terms: List[str]) -> str:
+        """将用户输入的词转换为 FTS5 短语查询，避免语法错误"""
+        return " ".join('"' + t.replace('"', '""') + '"' for t in terms)
+
+    @staticmethod
+    def _make_snippet(text: Optional[str], terms: List[str]) -> str:
+        """截取首个命中词附近的片段，转义 HTML 并用 <mark> 高亮所有命中词"""
+        if not text:
+            return ""
+        pattern = re.compile(
+            "|".join(re.escape(t) for t in sorted(terms, key=len, reverse=True)),
+            re.IGNORECASE
+        )
+        first = pattern.search(text)
+        if first is None:
+            # 该字段没有命中时显示开头部分作为预览
+            preview = text[:SNIPPET_RADIUS * 2]
+            return html.escape(preview + ("…" if len(text) > len(preview) else ""))
+
+        start = max(0, first.start() - SNIPPET_RADIUS)
+        end = min(len(text), first.end() + SNIPPET_RADIUS)
+        window = text[start:end]
+        marked = pattern.sub(lambda m: f"{HIGHLIGHT_START}{m.group(0)}{HIGHLIGHT_END}", window)
+        snippet = ("…" if start > 0 else "") + marked + ("…" if end < len(text) else "")
+        escaped = html.escape(snippet)
+        return escaped.replace(HIGHLIGHT_START, "<mark>").replace(HIGHLIGHT_END, "</mark>")
+
+    def close(self):
+        """停止索引线程并关闭数据库连接"""
+        self.stop()
+        if self.conn is not None:
+            self.read_conn.close()
+            self.conn.close()
+            self.conn = self.read_conn = None
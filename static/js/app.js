@@ -12,7 +12,9 @@ document.addEventListener('DOMContentLoaded', function() {
     
     // 自动刷新日志
     setInterval(() => {
-        loadLogs(currentTab);
+        if (currentTab !== 'search') {
+            loadLogs(currentTab);
+        }
     }, 5000);
 });
 
@@ -144,6 +146,96 @@ function getLogPreview(log) {
     return preview;
 }
 
+// 全文检索
+async function searchLogs(page) {
+    const query = document.getElementById('search-input').value.trim();
+    const type = document.getElementById('search-type').value;
+    const container = document.getElementById('search-results');
+    const pagination = document.getElementById('search-pagination');
+    
+    if (!query) {
+        container.innerHTML = '<div class="no-data">输入关键词开始检索</div>';
+        pagination.innerHTML = '';
+        return;
+    }
+    
+    container.innerHTML = '<div class="loading">检索中...</div>';
+    
+    try {
+        const params = new URLSearchParams({q: query, page: page, page_size: 20});
+        if (type) {
+            params.append('type', type);
+        }
+        const response = await fetch(`/api/search?${params}`);
+        const data = await response.json();
+        displaySearchResults(data);
+    } catch (error) {
+        container.innerHTML = `<div class="error">检索失败: ${error.message}</div>`;
+        pagination.innerHTML = '';
+    }
+}
+
+// 显示检索结果（片段已由后端转义并高亮）
+function displaySearchResults(data) {
+    const container = document.getElementById('search-results');
+    const pagination = document.getElementById('search-pagination');
+    
+    if (data.results.length === 0) {
+        container.innerHTML = '<div class="no-data">没有匹配的记录</div>';
+        pagination.innerHTML = '';
+        return;
+    }
+    
+    let html = '';
+    data.results.forEach(result => {
+        const timestamp = new Date(result.timestamp).toLocaleString('zh-CN');
+        const clickable = result.type === 'llm' ? `onclick="showSearchResultDetail('${result.id}')"` : '';
+        html += `
+            <div class="log-item" ${clickable}>
+                <div class="log-header">
+                    <div>
+                        <span class="log-type ${result.type}">${result.type.toUpperCase()}</span>
+                        <span class="log-summary">${escapeHtml(result.summary)}</span>
+                    </div>
+                    <span class="log-timestamp">${timestamp}</span>
+                </div>
+                <div class="log-details">
+                    ${result.prompt_snippet ? `<span class="preview-request">📤 ${result.prompt_snippet}</span>` : ''}
+                    ${result.prompt_snippet && result.completion_snippet ? '<br>' : ''}
+                    ${result.completion_snippet ? `<span class="preview-response">📥 ${result.completion_snippet}</span>` : ''}
+                </div>
+            </div>
+        `;
+    });
+    container.innerHTML = html;
+    
+    // 总数超过统计上限时只显示下限，是否有下一页按本页是否已满判断
+    const totalPages = Math.ceil(data.total / data.page_size);
+    const hasNext = data.total_capped ? data.results.length === data.page_size : data.page < totalPages;
+    const totalText = data.total_capped ? `${data.total}+` : `${data.total}`;
+    pagination.innerHTML = `
+        <button class="view-btn" ${data.page <= 1 ? 'disabled' : ''} onclick="searchLogs(${data.page - 1})">上一页</button>
+        <span>第 ${data.page} 页，共 ${totalText} 条</span>
+        <button class="view-btn" ${hasNext ? '' : 'disabled'} onclick="searchLogs(${data.page + 1})">下一页</button>
+    `;
+}
+
+// 从检索结果打开 LLM 日志详情
+async function showSearchResultDetail(logId) {
+    if (!logsData.llm.find(l => l.id === logId)) {
+        const response = await fetch(`/api/log/llm/${logId}`);
+        const details = await response.json();
+        if (details.error) return;
+        
+        let summary = `${details.method} ${details.path}`;
+        if (details.body && details.body.model) {
+            summary += ` (model: ${details.body.model})`;
+        }
+        logsData.llm.push({id: logId, timestamp: details.timestamp, type: 'llm', summary: summary, details: details});
+    }
+    showLogDetail('llm', logId);
+}
+
 // 显示日志详情
 async function showLogDetail(type, logId) {
     const log = logsData[type].find(l => l.id === logId);